@@ -0,0 +1,108 @@
+"""Shared constants and helpers for the BMS requirements Streamlit app.
+
+Kept in an importable module so the option tables and helper definitions are
+built once per process instead of on every script rerun.
+"""
+import streamlit as st
+import datetime
+from types import MappingProxyType
+import orjson
+
+__all__ = [
+    "APPLICATIONS", "CHEMISTRY", "IP_RATINGS", "VIBRATION", "ASIL", "SOC", "SOH", "BALANCING",
+    "SAFETY_OPTS", "INTERFACE_OPTS", "SECURITY_OPTS", "STEP1_CHECKS",
+    "init_state", "next_step", "prev_step", "reset_form", "kv", "kv_selectbox",
+    "calc_nominal_pack_voltage", "required", "download_json_button", "header",
+]
+
+# ===================== Select Options =====================
+# Option tuples for selectboxes; see kv_selectbox for index resolution.
+APPLICATIONS = ("Passenger EV", "2W/3W", "Commercial EV", "Energy Storage (ESS)", "Industrial Vehicle", "Drone/UAV", "Other")
+CHEMISTRY = ("NMC", "NCA", "LFP", "LTO", "Other")
+IP_RATINGS = ("IP54", "IP65", "IP67", "IP69K", "Not sure")
+VIBRATION = ("IEC 60068", "ISO 16750", "OEM-specific", "Not sure")
+ASIL = ("None/Not defined", "QM", "ASIL A", "ASIL B", "ASIL C", "ASIL D")
+SOC = ("Coulomb Counting", "OCV + Model", "Kalman/UKF", "Neural/Fusion", "Not sure")
+SOH = ("Rint/Impedance", "Capacity Fade Tracking", "Data-driven", "Hybrid", "Not sure")
+BALANCING = ("None", "Passive (bleed)", "Active (inductive/capacitive)")
+
+# Option tuples for multiselects
+SAFETY_OPTS = ("ISO 26262", "IEC 61508", "UL 2580", "AIS-156", "AIS-038 Rev 2", "UN 38.3", "Other")
+INTERFACE_OPTS = ("CAN 2.0", "CAN FD", "LIN", "UART", "Ethernet", "BLE/WiFi for service")
+SECURITY_OPTS = ("Secure Boot", "Signed Firmware", "Encrypted CAN", "Role-based auth")
+
+# Step 1 required fields: (key, predicate, label)
+STEP1_CHECKS = (
+    ("project_name", bool, "Project / Program Name"),
+    ("company", bool, "Company / Team"),
+    ("contact_email", bool, "Primary Contact Email"),
+    ("series_cells", lambda x: int(x or 0) > 0, "Cells in series (S)"),
+    ("pack_capacity_ah", lambda x: float(x or 0.0) > 0.0, "Target pack capacity (Ah)"),
+    ("max_cont_current_a", lambda x: float(x or 0.0) > 0.0, "Max continuous current (A)"),
+)
+
+# Typical cell nominal voltage (V) per chemistry
+CHEM_CELL_NOMINAL = MappingProxyType({"NMC": 3.6, "NCA": 3.6, "LFP": 3.2, "LTO": 2.4, "Other": 3.6})
+
+# ===================== App State & Helpers =====================
+def init_state():
+    defaults = {
+        "step": 1,
+        "data": {},
+        "submitted": False,
+        "saved": False,
+        "save_error": None,
+    }
+    for k, v in defaults.items():
+        if k not in st.session_state:
+            st.session_state[k] = v
+    # Stamp once per session so the download filename isn't rebuilt from the clock on every rerun
+    if "session_ts" not in st.session_state:
+        st.session_state["session_ts"] = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
+
+def next_step():
+    st.session_state.step = min(2, st.session_state.step + 1)
+
+def prev_step():
+    st.session_state.step = max(1, st.session_state.step - 1)
+
+def reset_form():
+    st.session_state.clear()
+    init_state()
+
+def kv(k, default=None):
+    return st.session_state["data"].get(k, default)
+
+# {options: {value: index}}, built once per options tuple
+_INDEX_CACHE = {}
+
+def kv_selectbox(label, key, options, default_idx=0, **kw):
+    """Selectbox preselected with the stored value for `key`, falling back to `default_idx`."""
+    idx_map = _INDEX_CACHE.get(options)
+    if idx_map is None:
+        idx_map = _INDEX_CACHE[options] = {v: i for i, v in enumerate(options)}
+    return st.selectbox(label, options, index=idx_map.get(kv(key), default_idx), **kw)
+
+def calc_nominal_pack_voltage(series_cells, chem, cell_nominal_override):
+    cell_nominal = cell_nominal_override or CHEM_CELL_NOMINAL.get(chem, 3.6)
+    try:
+        return round((series_cells or 0) * cell_nominal, 2)
+    except Exception:
+        return None
+
+def required(ok: bool, label: str):
+    if not ok:
+        st.caption(f"❗Please fill **{label}**")
+    return ok
+
+def download_json_button(data):
+    fname = f"BMS_Requirements_{st.session_state['session_ts']}.json"
+    payload = orjson.dumps(data, option=orjson.OPT_INDENT_2)
+    st.download_button("⬇️ Download JSON", data=payload, file_name=fname, mime="application/json")
+
+def header():
+    cols = st.columns([1, 5, 1])
+    with cols[1]:
+        st.markdown("### 🔋 Battery Management System — Requirements Intake")
+        st.caption("Two-step, easy form: **Basics** → **Advanced Features**")
+    st.divider()
@@ -1,113 +1,76 @@
 
 import streamlit as st
 import json, datetime
-import gspread
-from google.oauth2.service_account import Credentials
+import orjson
+
+from bms_common import *
 
 st.set_page_config(page_title="BMS Requirements Form", page_icon="🔋", layout="wide")
 
 # ===================== Google Sheets Storage =====================
-def get_gs_client():
-    """Build a gspread client from a Service Account JSON stored in st.secrets."""
+# Same one-hour TTL as the secrets check and sheet_link, so edited secrets reach the writer too
+@st.cache_resource(ttl="1h", show_spinner=False)
+def _gs_client():
+    """Authorize a gspread client from the Service Account JSON in st.secrets, reused across reruns."""
+    # Imported here so the Google client stack only loads on first submit, not at app start
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    info = json.loads(st.secrets["GCP_SERVICE_ACCOUNT"])
+    creds = Credentials.from_service_account_info(info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
+    return gspread.authorize(creds)
+
+@st.cache_resource(ttl="1h", show_spinner=False)
+def _worksheet():
+    """Open the target spreadsheet and reuse its first worksheet across reruns."""
+    return _gs_client().open_by_key(st.secrets["SHEET_ID"]).sheet1
+
+@st.cache_data(ttl="1h", show_spinner=False)
+def _secrets_ok():
+    """Check that the Google Sheets secrets are present; returns (ok, missing)."""
     # Expect st.secrets to contain:
     #   GCP_SERVICE_ACCOUNT (stringified JSON)
     #   SHEET_ID (the Google Sheets ID)
-    required = ["GCP_SERVICE_ACCOUNT", "SHEET_ID"]
-    for r in required:
-        if r not in st.secrets:
-            st.warning(f"Missing secret: {r}. Add it in Streamlit Cloud → Settings → Secrets.")
-            return None, None
-    svc_json = st.secrets["GCP_SERVICE_ACCOUNT"]
+    missing = [k for k in ("GCP_SERVICE_ACCOUNT", "SHEET_ID") if k not in st.secrets]
+    return not missing, missing
+
+def get_worksheet():
+    """Return the cached worksheet, or None if secrets are missing or invalid."""
+    ok, missing = _secrets_ok()
+    if not ok:
+        st.warning(f"Missing secrets: {', '.join(missing)}. Add them in Streamlit Cloud → Settings → Secrets.")
+        return None
     try:
-        info = json.loads(svc_json)
-    except Exception as e:
+        return _worksheet()
+    except json.JSONDecodeError as e:
         st.error(f"GCP_SERVICE_ACCOUNT is not valid JSON: {e}")
-        return None, None
-    creds = Credentials.from_service_account_info(info, scopes=["https://www.googleapis.com/auth/spreadsheets"])
-    client = gspread.authorize(creds)
-    return client, st.secrets["SHEET_ID"]
+        return None
+
+def _sheet_row(payload: dict):
+    ts = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
+    return [
+        ts,
+        payload.get("project_name",""),
+        payload.get("company",""),
+        payload.get("contact_email",""),
+        orjson.dumps(payload).decode(),
+    ]
 
 def append_to_sheet(payload: dict):
     """Append a new row with timestamp, contact info, and JSON payload to Google Sheets."""
-    client, sheet_id = get_gs_client()
-    if not client:
-        return False, "No Google Sheets client"
     try:
-        sh = client.open_by_key(sheet_id)
-        ws = sh.sheet1  # use first worksheet
-        ts = datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S")
-        row = [
-            ts,
-            payload.get("project_name",""),
-            payload.get("company",""),
-            payload.get("contact_email",""),
-            json.dumps(payload, ensure_ascii=False),
-        ]
-        ws.append_row(row, value_input_option="USER_ENTERED")
+        ws = get_worksheet()
+        if ws is None:
+            return False, "No Google Sheets client"
+        ws.append_row(_sheet_row(payload), value_input_option="USER_ENTERED")
         return True, None
     except Exception as e:
         return False, str(e)
 
+@st.cache_data(ttl="1h", show_spinner=False)
 def sheet_link():
-    if "SHEET_ID" in st.secrets:
-        sid = st.secrets["SHEET_ID"]
-        return f"https://docs.google.com/spreadsheets/d/{sid}/edit"
-    return None
-
-# ===================== App State & Helpers =====================
-def init_state():
-    defaults = {
-        "step": 1,
-        "data": {},
-        "chem_cell_nominal_map": {"NMC": 3.6, "NCA": 3.6, "LFP": 3.2, "LTO": 2.4, "Other": 3.6},
-        "submitted": False,
-        "saved": False,
-        "save_error": None,
-    }
-    for k, v in defaults.items():
-        if k not in st.session_state:
-            st.session_state[k] = v
-
-def next_step():
-    st.session_state.step = min(2, st.session_state.step + 1)
-
-def prev_step():
-    st.session_state.step = max(1, st.session_state.step - 1)
-
-def reset_form():
-    for k in list(st.session_state.keys()):
-        del st.session_state[k]
-    init_state()
-
-def kv(k, default=None):
-    return st.session_state["data"].get(k, default)
-
-def set_kv(k, v):
-    st.session_state["data"][k] = v
-
-def calc_nominal_pack_voltage(series_cells, chem, cell_nominal_override):
-    base = st.session_state["chem_cell_nominal_map"].get(chem, 3.6)
-    cell_nominal = cell_nominal_override or base
-    try:
-        return round((series_cells or 0) * cell_nominal, 2)
-    except Exception:
-        return None
-
-def required(ok: bool, label: str):
-    if not ok:
-        st.caption(f"❗Please fill **{label}**")
-    return ok
-
-def download_json_button(data):
-    fname = f"BMS_Requirements_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
-    st.download_button("⬇️ Download JSON", data=json.dumps(data, indent=2), file_name=fname, mime="application/json")
-
-def header():
-    cols = st.columns([1, 5, 1])
-    with cols[1]:
-        st.markdown("### 🔋 Battery Management System — Requirements Intake")
-        st.caption("Two-step, easy form: **Basics** → **Advanced Features**")
-    st.divider()
+    sid = st.secrets.get("SHEET_ID")
+    return f"https://docs.google.com/spreadsheets/d/{sid}/edit" if sid else None
 
 # ===================== UI =====================
 init_state()
@@ -124,9 +87,11 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### Load previous JSON")
     up = st.file_uploader("Upload requirements JSON", type=["json"], label_visibility="collapsed")
-    if up is not None:
+    # Parse each upload once; re-applying it on every rerun would overwrite later edits
+    if up is not None and st.session_state.get("loaded_upload_id") != up.file_id:
         try:
-            st.session_state.data = json.load(up)
+            st.session_state.data = orjson.loads(up.getbuffer())
+            st.session_state["loaded_upload_id"] = up.file_id
             st.success("Loaded previous responses.")
         except Exception as e:
             st.error(f"Could not load JSON: {e}")
@@ -135,106 +100,113 @@ with st.sidebar:
 if st.session_state.step == 1:
     st.subheader("Step 1 — Basics")
     st.caption("Tell us about the application and pack fundamentals.")
-    c1, c2 = st.columns(2)
-
-    with c1:
-        set_kv("project_name", st.text_input("Project / Program Name *", kv("project_name", "")))
-        set_kv("company", st.text_input("Company / Team *", kv("company", "")))
-        set_kv("contact_email", st.text_input("Primary Contact Email *", kv("contact_email", "")))
-
-        set_kv("application", st.selectbox(
-            "Application Segment *",
-            ["Passenger EV", "2W/3W", "Commercial EV", "Energy Storage (ESS)", "Industrial Vehicle", "Drone/UAV", "Other"],
-            index=(["Passenger EV","2W/3W","Commercial EV","Energy Storage (ESS)","Industrial Vehicle","Drone/UAV","Other"].index(kv("application")) if kv("application") in ["Passenger EV","2W/3W","Commercial EV","Energy Storage (ESS)","Industrial Vehicle","Drone/UAV","Other"] else 0)
-        ))
-
-        set_kv("chemistry", st.selectbox(
-            "Cell Chemistry *", ["NMC", "NCA", "LFP", "LTO", "Other"],
-            index=(["NMC","NCA","LFP","LTO","Other"].index(kv("chemistry")) if kv("chemistry") in ["NMC","NCA","LFP","LTO","Other"] else 0)
-        ))
-        set_kv("cell_nominal_v", st.number_input("Cell nominal voltage (V) — optional override", min_value=0.0, max_value=10.0, value=float(kv("cell_nominal_v", 0.0)), step=0.01, help="Leave 0 to use typical chemistry value"))
-    with c2:
-        set_kv("series_cells", st.number_input("Cells in series (S) *", min_value=0, max_value=1000, value=int(kv("series_cells", 0))))
-        set_kv("parallel_cells", st.number_input("Cells in parallel (P)", min_value=0, max_value=1000, value=int(kv("parallel_cells", 0))))
-        set_kv("pack_capacity_ah", st.number_input("Target pack capacity (Ah) *", min_value=0.0, max_value=10000.0, value=float(kv("pack_capacity_ah", 0.0)), step=0.1))
-        set_kv("max_cont_current_a", st.number_input("Max continuous current (A) *", min_value=0.0, max_value=10000.0, value=float(kv("max_cont_current_a", 0.0)), step=0.1))
-        set_kv("max_peak_current_a", st.number_input("Max peak current (A)", min_value=0.0, max_value=10000.0, value=float(kv("max_peak_current_a", 0.0)), step=0.1))
-
-    st.markdown("##### Environment & Compliance")
-    e1, e2, e3 = st.columns(3)
-    with e1:
-        set_kv("min_temp_c", st.number_input("Min ambient (°C)", -60, 100, int(kv("min_temp_c", 0))))
-        set_kv("max_temp_c", st.number_input("Max ambient (°C)", -60, 150, int(kv("max_temp_c", 40))))
-    with e2:
-        set_kv("ingress_protection", st.selectbox("Target IP rating", ["IP54", "IP65", "IP67", "IP69K", "Not sure"], index=(["IP54","IP65","IP67","IP69K","Not sure"].index(kv("ingress_protection")) if kv("ingress_protection") in ["IP54","IP65","IP67","IP69K","Not sure"] else 2)))
-        set_kv("vibration_standard", st.selectbox("Vibration/Mechanical", ["IEC 60068", "ISO 16750", "OEM-specific", "Not sure"], index=(["IEC 60068","ISO 16750","OEM-specific","Not sure"].index(kv("vibration_standard")) if kv("vibration_standard") in ["IEC 60068","ISO 16750","OEM-specific","Not sure"] else 3)))
-    with e3:
-        set_kv("safety_standards", st.multiselect("Safety/Regulatory (choose all that apply)",
-                        ["ISO 26262", "IEC 61508", "UL 2580", "AIS-156", "AIS-038 Rev 2", "UN 38.3", "Other"],
-                        default=kv("safety_standards", [])))
-        set_kv("asil_level", st.selectbox("Target ASIL", ["None/Not defined","QM","ASIL A","ASIL B","ASIL C","ASIL D"],
-                                          index=(["None/Not defined","QM","ASIL A","ASIL B","ASIL C","ASIL D"].index(kv("asil_level")) if kv("asil_level") in ["None/Not defined","QM","ASIL A","ASIL B","ASIL C","ASIL D"] else 0)))
-
-    st.markdown("##### Interfaces")
-    set_kv("interfaces", st.multiselect("Communication Interfaces", ["CAN 2.0", "CAN FD", "LIN", "UART", "Ethernet", "BLE/WiFi for service"], default=kv("interfaces", ["CAN FD"])))
-    set_kv("nominal_pack_voltage_v", calc_nominal_pack_voltage(kv("series_cells", 0), kv("chemistry", "NMC"), kv("cell_nominal_v", 0.0)))
-
-    with st.expander("Calculated fields"):
-        st.metric("Estimated nominal pack voltage (V)", kv("nominal_pack_voltage_v", 0.0))
-
-    # Validation & Navigation
-    req_ok = True
-    req_ok &= required(bool(kv("project_name")), "Project / Program Name")
-    req_ok &= required(bool(kv("company")), "Company / Team")
-    req_ok &= required(bool(kv("contact_email")), "Primary Contact Email")
-    req_ok &= required(int(kv("series_cells", 0)) > 0, "Cells in series (S)")
-    req_ok &= required(float(kv("pack_capacity_ah", 0.0)) > 0.0, "Target pack capacity (Ah)")
-    req_ok &= required(float(kv("max_cont_current_a", 0.0)) > 0.0, "Max continuous current (A)")
-
-    left, mid, right = st.columns([1,2,1])
-    with mid:
-        st.button("➡️ Next: Advanced Features", type="primary", use_container_width=True, on_click=next_step, disabled=not req_ok)
+    with st.form("step1_form", clear_on_submit=False):
+        new = {}
+        c1, c2 = st.columns(2)
+
+        with c1:
+            new["project_name"] = st.text_input("Project / Program Name *", kv("project_name", ""))
+            new["company"] = st.text_input("Company / Team *", kv("company", ""))
+            new["contact_email"] = st.text_input("Primary Contact Email *", kv("contact_email", ""))
+
+            new["application"] = kv_selectbox("Application Segment *", "application", APPLICATIONS)
+
+            new["chemistry"] = kv_selectbox("Cell Chemistry *", "chemistry", CHEMISTRY)
+            new["cell_nominal_v"] = st.number_input("Cell nominal voltage (V) — optional override", min_value=0.0, max_value=10.0, value=float(kv("cell_nominal_v", 0.0)), step=0.01, help="Leave 0 to use typical chemistry value")
+        with c2:
+            new["series_cells"] = st.number_input("Cells in series (S) *", min_value=0, max_value=1000, value=int(kv("series_cells", 0)))
+            new["parallel_cells"] = st.number_input("Cells in parallel (P)", min_value=0, max_value=1000, value=int(kv("parallel_cells", 0)))
+            new["pack_capacity_ah"] = st.number_input("Target pack capacity (Ah) *", min_value=0.0, max_value=10000.0, value=float(kv("pack_capacity_ah", 0.0)), step=0.1)
+            new["max_cont_current_a"] = st.number_input("Max continuous current (A) *", min_value=0.0, max_value=10000.0, value=float(kv("max_cont_current_a", 0.0)), step=0.1)
+            new["max_peak_current_a"] = st.number_input("Max peak current (A)", min_value=0.0, max_value=10000.0, value=float(kv("max_peak_current_a", 0.0)), step=0.1)
+
+        st.markdown("##### Environment & Compliance")
+        e1, e2, e3 = st.columns(3)
+        with e1:
+            new["min_temp_c"] = st.number_input("Min ambient (°C)", -60, 100, int(kv("min_temp_c", 0)))
+            new["max_temp_c"] = st.number_input("Max ambient (°C)", -60, 150, int(kv("max_temp_c", 40)))
+        with e2:
+            new["ingress_protection"] = kv_selectbox("Target IP rating", "ingress_protection", IP_RATINGS, 2)
+            new["vibration_standard"] = kv_selectbox("Vibration/Mechanical", "vibration_standard", VIBRATION, 3)
+        with e3:
+            new["safety_standards"] = st.multiselect("Safety/Regulatory (choose all that apply)", SAFETY_OPTS, default=kv("safety_standards", []))
+            new["asil_level"] = kv_selectbox("Target ASIL", "asil_level", ASIL)
+
+        st.markdown("##### Interfaces")
+        new["interfaces"] = st.multiselect("Communication Interfaces", INTERFACE_OPTS, default=kv("interfaces", ["CAN FD"]))
+        new["nominal_pack_voltage_v"] = calc_nominal_pack_voltage(new["series_cells"], new["chemistry"], new["cell_nominal_v"])
+        st.session_state["data"].update(new)
+
+        with st.expander("Calculated fields"):
+            st.metric("Estimated nominal pack voltage (V)", new["nominal_pack_voltage_v"])
+            st.caption("Calculated from the last submitted values; recalculate to include recent edits.")
+            st.form_submit_button("🔄 Recalculate")
+
+        # Validation & Navigation
+        # Evaluate every check (no short-circuit) so each missing field gets its caption
+        results = [required(pred(new.get(k)), label) for k, pred, label in STEP1_CHECKS]
+        req_ok = all(results)
+
+        left, mid, right = st.columns([1,2,1])
+        with mid:
+            next_clicked = st.form_submit_button("➡️ Next: Advanced Features", type="primary", use_container_width=True)
+
+    if next_clicked and req_ok:
+        next_step()
+        st.rerun()
 
 # Step 2
 if st.session_state.step == 2:
     st.subheader("Step 2 — Advanced Features")
     st.caption("Fine-tune algorithms, protections, controls, and serviceability.")
 
-    a1, a2 = st.columns(2)
-    with a1:
-        set_kv("soc_method", st.selectbox("SoC Estimation", ["Coulomb Counting", "OCV + Model", "Kalman/UKF", "Neural/Fusion", "Not sure"], index=(["Coulomb Counting","OCV + Model","Kalman/UKF","Neural/Fusion","Not sure"].index(kv("soc_method")) if kv("soc_method") in ["Coulomb Counting","OCV + Model","Kalman/UKF","Neural/Fusion","Not sure"] else 1)))
-        set_kv("soh_method", st.selectbox("SoH Estimation", ["Rint/Impedance", "Capacity Fade Tracking", "Data-driven", "Hybrid", "Not sure"], index=(["Rint/Impedance","Capacity Fade Tracking","Data-driven","Hybrid","Not sure"].index(kv("soh_method")) if kv("soh_method") in ["Rint/Impedance","Capacity Fade Tracking","Data-driven","Hybrid","Not sure"] else 2)))
-        set_kv("balancing", st.selectbox("Cell Balancing", ["None","Passive (bleed)", "Active (inductive/capacitive)"], index=(["None","Passive (bleed)","Active (inductive/capacitive)"].index(kv("balancing")) if kv("balancing") in ["None","Passive (bleed)","Active (inductive/capacitive)"] else 1)))
-        set_kv("balancing_power_w", st.number_input("Balancing power per cell (W)", 0.0, 20.0, float(kv("balancing_power_w", 0.5)), 0.1))
-    with a2:
-        set_kv("logging_rate_hz", st.number_input("Data logging rate (Hz)", 0.0, 1000.0, float(kv("logging_rate_hz", 1.0)), 0.1))
-        set_kv("ota_updates", st.checkbox("OTA firmware updates", value=bool(kv("ota_updates", True))))
-        set_kv("security", st.multiselect("Security", ["Secure Boot", "Signed Firmware", "Encrypted CAN", "Role-based auth"], default=kv("security", ["Secure Boot","Signed Firmware"])))
-
-    st.markdown("##### Protections")
-    p1, p2, p3 = st.columns(3)
-    with p1:
-        set_kv("ov_th_v", st.number_input("Over-voltage threshold (V/cell)", 2.0, 6.0, float(kv("ov_th_v", 4.25)), 0.01))
-        set_kv("uv_th_v", st.number_input("Under-voltage threshold (V/cell)", 1.0, 4.0, float(kv("uv_th_v", 2.5)), 0.01))
-    with p2:
-        set_kv("ocd_a", st.number_input("Over-current discharge (A)", 0.0, 20000.0, float(kv("ocd_a", 400.0)), 1.0))
-        set_kv("occ_a", st.number_input("Over-current charge (A)", 0.0, 20000.0, float(kv("occ_a", 200.0)), 1.0))
-    with p3:
-        set_kv("ot_c", st.number_input("Over-temperature (°C)", 20, 120, int(kv("ot_c", 80))))
-        set_kv("ut_c", st.number_input("Under-temperature (°C)", -60, 40, int(kv("ut_c", -10))))
-
-    # Submit & storage
-    st.divider()
-    st.markdown("#### Submit & Save")
-    st.caption("Click submit to append your response to a Google Sheet and optionally download the JSON.")
-
-    c1, c2, c3 = st.columns([1,1,1])
-    with c1:
-        st.button("⬅️ Back", use_container_width=True, on_click=prev_step)
-    with c2:
-        submit_clicked = st.button("💾 Submit & Save ", type="primary", use_container_width=True)
-    with c3:
-        download_json_button(st.session_state["data"])
+    # Enter in a number input would otherwise fire the first submit button (Back)
+    with st.form("step2_form", clear_on_submit=False, enter_to_submit=False):
+        new = {}
+        a1, a2 = st.columns(2)
+        with a1:
+            new["soc_method"] = kv_selectbox("SoC Estimation", "soc_method", SOC, 1)
+            new["soh_method"] = kv_selectbox("SoH Estimation", "soh_method", SOH, 2)
+            new["balancing"] = kv_selectbox("Cell Balancing", "balancing", BALANCING, 1)
+            new["balancing_power_w"] = st.number_input("Balancing power per cell (W)", 0.0, 20.0, float(kv("balancing_power_w", 0.5)), 0.1)
+        with a2:
+            new["logging_rate_hz"] = st.number_input("Data logging rate (Hz)", 0.0, 1000.0, float(kv("logging_rate_hz", 1.0)), 0.1)
+            new["ota_updates"] = st.checkbox("OTA firmware updates", value=bool(kv("ota_updates", True)))
+            new["security"] = st.multiselect("Security", SECURITY_OPTS, default=kv("security", ["Secure Boot","Signed Firmware"]))
+
+        st.markdown("##### Protections")
+        p1, p2, p3 = st.columns(3)
+        with p1:
+            new["ov_th_v"] = st.number_input("Over-voltage threshold (V/cell)", 2.0, 6.0, float(kv("ov_th_v", 4.25)), 0.01)
+            new["uv_th_v"] = st.number_input("Under-voltage threshold (V/cell)", 1.0, 4.0, float(kv("uv_th_v", 2.5)), 0.01)
+        with p2:
+            new["ocd_a"] = st.number_input("Over-current discharge (A)", 0.0, 20000.0, float(kv("ocd_a", 400.0)), 1.0)
+            new["occ_a"] = st.number_input("Over-current charge (A)", 0.0, 20000.0, float(kv("occ_a", 200.0)), 1.0)
+        with p3:
+            new["ot_c"] = st.number_input("Over-temperature (°C)", 20, 120, int(kv("ot_c", 80)))
+            new["ut_c"] = st.number_input("Under-temperature (°C)", -60, 40, int(kv("ut_c", -10)))
+
+        # Submit & storage
+        st.divider()
+        st.markdown("#### Submit & Save")
+        st.caption("Apply changes to update the JSON download and preview. Submit also appends your response to a Google Sheet.")
+
+        c1, c2, c3 = st.columns(3)
+        with c1:
+            back_clicked = st.form_submit_button("⬅️ Back", use_container_width=True)
+        with c2:
+            # Commits the form into data (below) without saving to the sheet
+            st.form_submit_button("✔️ Apply changes", use_container_width=True)
+        with c3:
+            submit_clicked = st.form_submit_button("💾 Submit & Save ", type="primary", use_container_width=True)
+    st.session_state["data"].update(new)
+
+    if back_clicked:
+        prev_step()
+        st.rerun()
+
+    download_json_button(st.session_state["data"])
+    st.caption("The download and preview reflect your last Apply or Submit; edits made since then are not included.")
 
     if submit_clicked:
         st.session_state["submitted"] = True
@@ -250,8 +222,8 @@ if st.session_state.step == 2:
             st.error(f"❌ Save failed: {err}")
 
     st.markdown("---")
-    st.markdown("#### Live Preview of Submission JSON")
-    st.json(st.session_state["data"])
+    with st.expander("Preview of Submission JSON", expanded=False):
+        st.json(st.session_state["data"])
 
 # Footer
 st.markdown("")